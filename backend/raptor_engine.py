@@ -1,159 +1,318 @@
 import csv
 import os
 import math
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from functools import lru_cache
+from operator import itemgetter
 from datetime import datetime
 from pytz import timezone
 from typing import List, Dict, Tuple, Optional
 from concurrent.futures import ProcessPoolExecutor
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
+from array import array
+from multiprocessing import shared_memory
+import weakref
+import threading
+import pickle
 
 CALIF_TZ = timezone('America/Los_Angeles')
 
 # --- WORKER GLOBALS ---
 # These are initialized in every worker process once
-G_STOPS = {}
+# Stops are addressed by integer index in the worker; labels are flat lists indexed by it
+G_STOP_IDS = []      # stop index -> stop_id
+G_STOP_INDEX = {}    # stop_id -> stop index
+# Stop coordinates in radians plus cos(lat), precomputed for the A* bound
+G_STOP_LAT_RAD = array('d')
+G_STOP_LON_RAD = array('d')
+G_STOP_COS_LAT = array('d')
+# Footpaths in CSR form: stop i walks to G_FP_TO[j] in G_FP_WALK[j] seconds
+# for j in range(G_FP_OFFSET[i], G_FP_OFFSET[i + 1])
+G_FP_OFFSET = array('i')
+G_FP_TO = array('i')
+G_FP_WALK = array('i')
+# Routes are addressed by integer index as well (position in RaptorRouter.route_ids)
 G_ROUTES = {}
+# Route -> stop indices as CSR: route i visits G_RS_STOP[G_RS_OFFSET[i]:G_RS_OFFSET[i + 1]]
+G_RS_OFFSET = array('i')
+G_RS_STOP = array('i')
+G_ROUTE_TRIPS = []   # route index -> trip_ids sorted by departure
 G_TRIPS = {}
-G_STOP_TO_ROUTES = {}
-G_ROUTE_STOP_INDEX = {}
-G_ROUTE_STOP_TIMES_CACHE = {}
-
-def init_worker(stops, routes, trips, s2r, rsi, rstc):
+# Stop -> routes in CSR form: stop i is served by route G_SR_ROUTE[j] at position
+# G_SR_POS[j] for j in range(G_SR_OFFSET[i], G_SR_OFFSET[i + 1])
+G_SR_OFFSET = array('i')
+G_SR_ROUTE = array('i')
+G_SR_POS = array('i')
+G_DEP_TIMES = array('i')
+G_ARR_TIMES = array('i')
+G_ROUTE_TIME_OFFSET = array('i')   # route index -> start of its block in the timetable
+G_SHARED_BLOCKS = []
+
+# Label buffers pooled for the lifetime of the worker process (see _reset_labels).
+# Arrival labels are hot (read by every scan); the parent arrays are cold, written
+# next to an improved label and only read back by _reconstruct_path.
+G_ROUND_LABELS = []       # round -> arrival time per stop index
+G_BEST_ARRIVAL = []       # stop index -> best arrival over all rounds
+G_PARENT_STOP = []        # round -> boarding / walk-origin stop index per stop, -1 = none
+G_PARENT_TRIP = []        # round -> trip_id ridden into the stop, None for a walk
+G_PARENT_DEP = []         # round -> departure time from the parent stop
+G_DIRTY_LABELS = None     # [stops updated in round 0, round 1, ...] of the last query
+
+def share_arrays(arrays):
+    """
+    Packs named arrays into a single shared memory block.
+    Workers map the block instead of unpickling their own copies, so every
+    process reads the same physical pages. Returns the block and its layout,
+    [(name, typecode, byte_offset, length), ...], for attach_arrays.
+    """
+    layout = []
+    size = 0
+    for name, arr in arrays.items():
+        size = (size + 7) & ~7  # keep every array 8-byte aligned
+        layout.append((name, arr.typecode, size, len(arr)))
+        size += arr.itemsize * len(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for (name, typecode, start, length), arr in zip(layout, arrays.values()):
+        shm.buf[start:start + arr.itemsize * length] = memoryview(arr).cast('B')
+    return shm, layout
+
+def attach_arrays(name, layout):
+    """Returns {name: zero-copy, array-like memoryview} over a block made by share_arrays."""
+    shm = shared_memory.SharedMemory(name=name)
+    # Keep the handle alive for the lifetime of the worker; the views borrow its buffer
+    G_SHARED_BLOCKS.append(shm)
+    views = {}
+    for key, typecode, start, length in layout:
+        views[key] = shm.buf[start:start + array(typecode).itemsize * length].cast(typecode)
+    return views
+
+def release_shared(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+def init_worker(stop_ids, routes, route_trips, trips, shm_name, shm_layout):
     """
     Initializes global read-only data for worker processes.
     This runs once per process when the pool is created.
     """
-    global G_STOPS, G_ROUTES, G_TRIPS, G_STOP_TO_ROUTES, G_ROUTE_STOP_INDEX, G_ROUTE_STOP_TIMES_CACHE
-    G_STOPS = stops
+    global G_STOP_IDS, G_STOP_INDEX, G_STOP_LAT_RAD, G_STOP_LON_RAD, G_STOP_COS_LAT
+    global G_FP_OFFSET, G_FP_TO, G_FP_WALK
+    global G_ROUTES, G_RS_OFFSET, G_RS_STOP, G_ROUTE_TRIPS, G_TRIPS, G_SR_OFFSET, G_SR_ROUTE, G_SR_POS
+    global G_DEP_TIMES, G_ARR_TIMES, G_ROUTE_TIME_OFFSET
+    global G_ROUND_LABELS, G_BEST_ARRIVAL, G_PARENT_STOP, G_PARENT_TRIP, G_PARENT_DEP, G_DIRTY_LABELS
+    G_STOP_IDS = stop_ids
+    G_STOP_INDEX = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+    shared = attach_arrays(shm_name, shm_layout)
+    G_STOP_LAT_RAD = shared['stop_lat_rad']
+    G_STOP_LON_RAD = shared['stop_lon_rad']
+    G_STOP_COS_LAT = shared['stop_cos_lat']
+    G_FP_OFFSET = shared['fp_offset']
+    G_FP_TO = shared['fp_to']
+    G_FP_WALK = shared['fp_walk']
+    G_SR_OFFSET = shared['sr_offset']
+    G_SR_ROUTE = shared['sr_route']
+    G_SR_POS = shared['sr_pos']
+    G_RS_OFFSET = shared['rs_offset']
+    G_RS_STOP = shared['rs_stop']
     G_ROUTES = routes
+    G_ROUTE_TRIPS = route_trips
     G_TRIPS = trips
-    G_STOP_TO_ROUTES = s2r
-    G_ROUTE_STOP_INDEX = rsi
-    G_ROUTE_STOP_TIMES_CACHE = rstc
+    G_DEP_TIMES = shared['dep_times']
+    G_ARR_TIMES = shared['arr_times']
+    G_ROUTE_TIME_OFFSET = shared['route_time_offset']
+    G_ROUND_LABELS = []
+    G_BEST_ARRIVAL = [float('inf')] * len(stop_ids)
+    G_PARENT_STOP = []
+    G_PARENT_TRIP = []
+    G_PARENT_DEP = []
+    G_DIRTY_LABELS = None
+    _add_round_buffers()
+
+def _add_round_buffers():
+    """Grows the pool by one round of label and parent arrays."""
+    n_stops = len(G_STOP_IDS)
+    G_ROUND_LABELS.append([float('inf')] * n_stops)
+    G_PARENT_STOP.append([-1] * n_stops)
+    G_PARENT_TRIP.append([None] * n_stops)
+    G_PARENT_DEP.append([0] * n_stops)
+
+def _reset_labels():
+    """
+    Restores the pooled buffers after a query. Every label write marks its stop
+    for the round, so the per-round marked sets list exactly the entries to
+    reset - O(touched stops), not O(all stops).
+    """
+    global G_DIRTY_LABELS
+    if G_DIRTY_LABELS is None:
+        return
+    INF = float('inf')
+    for k, updated in enumerate(G_DIRTY_LABELS):
+        labels = G_ROUND_LABELS[k]
+        parent_stop = G_PARENT_STOP[k]
+        for stop in updated:
+            labels[stop] = INF
+            G_BEST_ARRIVAL[stop] = INF
+            parent_stop[stop] = -1
+    G_DIRTY_LABELS = None
 
 def run_raptor_worker(source_stop_id, target_stop_id, departure_time_seconds):
     """
     Standalone RAPTOR query function that runs in a worker process.
     Uses global variables for data access to avoid pickling overhead on every call.
     """
-    if source_stop_id not in G_STOPS or target_stop_id not in G_STOPS:
+    source = G_STOP_INDEX.get(source_stop_id)
+    target = G_STOP_INDEX.get(target_stop_id)
+    if source is None or target is None:
         return {'journeys': []}
 
-    # arrival_times[k][stop_id] = earliest arrival time at stop_id with exactly k-1 transfers
+    # arrival_times[k][stop] = earliest arrival time at stop index with exactly k-1 transfers
     max_rounds = 30
+    INF = float('inf')
     
-    # OPTIMIZATION: Lazy Initialization
-    # O(1) initialization instead of O(N)
-    arrival_times = [defaultdict(lambda: float('inf')) for _ in range(max_rounds + 1)]
-    best_arrival = defaultdict(lambda: float('inf'))
-    
-    # parent_pointers[round][stop_id] = (prev_stop, trip_id, board_stop, type, dep_time, arr_time)
-    parent_pointers = defaultdict(dict)
+    # OPTIMIZATION: Flat per-round labels, pooled across queries
+    # Each round is one list indexed by stop. The lists live for the whole worker
+    # process and only the entries written by the previous query are reset, so
+    # a query performs no O(n_stops) allocation or fill after warm-up.
+    global G_DIRTY_LABELS
+    _reset_labels()
+    arrival_times = G_ROUND_LABELS
+    best_arrival = G_BEST_ARRIVAL
     
     # Minimum time needed for a transfer (2 minutes)
     TRANSFER_BUFFER = 120
     
-    arrival_times[0][source_stop_id] = departure_time_seconds
-    best_arrival[source_stop_id] = departure_time_seconds
+    arrival_times[0][source] = departure_time_seconds
+    best_arrival[source] = departure_time_seconds
     
-    marked_stops = {source_stop_id}
+    marked_stops = {source}
+    # Stops updated per round; doubles as the reset list for the pooled buffers
+    updated_by_round = [marked_stops]
+    G_DIRTY_LABELS = updated_by_round
+    
+    # OPTIMIZATION: Hoist worker globals and math functions into locals once per
+    # query, so the hot loops below use fast local loads instead of global lookups
+    lat_rad, lon_rad, cos_lat = G_STOP_LAT_RAD, G_STOP_LON_RAD, G_STOP_COS_LAT
+    sr_offset, sr_route, sr_pos = G_SR_OFFSET, G_SR_ROUTE, G_SR_POS
+    fp_offset, fp_to, fp_walk = G_FP_OFFSET, G_FP_TO, G_FP_WALK
+    rs_offset, rs_stop = G_RS_OFFSET, G_RS_STOP
+    route_trips, route_time_offset = G_ROUTE_TRIPS, G_ROUTE_TIME_OFFSET
+    dep_times, arr_times = G_DEP_TIMES, G_ARR_TIMES
+    sin, sqrt, atan2 = math.sin, math.sqrt, math.atan2
     
     # Pre-fetch target coords for A* pruning
-    t_stop = G_STOPS[target_stop_id]
-    t_lat, t_lon = t_stop.lat, t_stop.lon
+    t_lat, t_lon, t_cos = lat_rad[target], lon_rad[target], cos_lat[target]
     
     # Max speed for heuristic (e.g. 130 km/h ~ 36 m/s) - conservative upper bound for transit
     MAX_SPEED_MPS = 36.0 
 
-    def get_min_time_to_target(s_id):
-        s = G_STOPS[s_id]
-        # Haversine equivalent inline or helper
-        # Approximate distance is fine for pruning
-        # Using simple euclidean for specialized speed (lat/lon to meters is complex, assume worst case)
-        # Better: use the global haversine if available or duplicate it
-        # duplicating minimal haversine for speed
+    # The bound only depends on the stop, so it is computed at most once per stop per query
+    min_time_cache = {}
+
+    def get_min_time_to_target(stop):
+        cached = min_time_cache.get(stop)
+        if cached is not None:
+            return cached
+        # Haversine inline on precomputed radians and cos(lat): no degree
+        # conversions or cos of the stop's latitude per call
         R = 6371000 # meters
-        dLat = math.radians(t_lat - s.lat)
-        dLon = math.radians(t_lon - s.lon)
-        a = math.sin(dLat/2)**2 + math.cos(math.radians(s.lat)) * math.cos(math.radians(t_lat)) * math.sin(dLon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+        dLat = t_lat - lat_rad[stop]
+        dLon = t_lon - lon_rad[stop]
+        a = sin(dLat/2)**2 + cos_lat[stop] * t_cos * sin(dLon/2)**2
+        c = 2 * atan2(sqrt(a), sqrt(1-a))
         dist_m = R * c
-        return dist_m / MAX_SPEED_MPS
+        min_time_cache[stop] = dist_m / MAX_SPEED_MPS
+        return min_time_cache[stop]
 
     for k in range(1, max_rounds + 1):
+        if k == len(arrival_times):
+            _add_round_buffers()
+        
         routes_to_scan = {}
-        for stop_id in marked_stops:
+        route_board_arrival = {}
+        route_bound = {}  # route -> min over its boardable stops of arrival + min_time_to_target
+        prev_labels = arrival_times[k-1]
+        # The target label cannot change while routes are being collected
+        best_target_arr = best_arrival[target]
+        for stop in marked_stops:
             # PRUNING: A* optimization
             # If current_arrival + min_time_to_target > best_known_arrival_at_target, then skip
             # This is safe because it's physically impossible to beat the best time
-            curr_arr = arrival_times[k-1][stop_id]
-            best_target_arr = best_arrival[target_stop_id]
+            curr_arr = prev_labels[stop]
+            bound = curr_arr + get_min_time_to_target(stop)
+            if bound > best_target_arr:
+                continue # Prune this branch
+            if bound != bound:
+                bound = -INF  # NaN: a stop without coordinates never lets its routes be pruned
             
-            if best_target_arr < float('inf'):
-                 min_time = get_min_time_to_target(stop_id)
-                 if curr_arr + min_time > best_target_arr:
-                     continue # Prune this branch
-            
-            for route_id in G_STOP_TO_ROUTES.get(stop_id, []):
-                pos = G_ROUTE_STOP_INDEX[route_id][stop_id]
-                if route_id not in routes_to_scan or pos < routes_to_scan[route_id]:
-                    routes_to_scan[route_id] = pos
+            lo = sr_offset[stop]
+            hi = sr_offset[stop + 1]
+            for route, pos in zip(sr_route[lo:hi], sr_pos[lo:hi]):
+                start = routes_to_scan.get(route)
+                if start is None or pos < start:
+                    routes_to_scan[route] = pos
+                if curr_arr < route_board_arrival.get(route, INF):
+                    route_board_arrival[route] = curr_arr
+                if bound < route_bound.get(route, INF):
+                    route_bound[route] = bound
+        
+        # OPTIMIZATION: Dial's buckets
+        # Scan routes in order of their earliest boarding arrival, bucketed by the
+        # transfer buffer, so the target label tightens early and prunes more of
+        # the remaining scans in this round. Bucketing is O(1) per route.
+        buckets = defaultdict(list)
+        for route, board_arr in route_board_arrival.items():
+            buckets[(board_arr - departure_time_seconds) // TRANSFER_BUFFER].append(route)
+        
+        scan_order = [route for bucket in sorted(buckets) for route in buckets[bucket]]
+        
+        # Apply transfer buffer when boarding after a previous ride
+        min_change = TRANSFER_BUFFER if k > 1 else 0
         
         marked_stops = set()
-        for route_id, start_pos in routes_to_scan.items():
-            route = G_ROUTES[route_id]
-            current_trip_id = None
-            boarding_stop = None
-            boarding_time = None
-            
-            for pos in range(start_pos, len(route.stops)):
-                stop_id = route.stops[pos]
-                if current_trip_id is not None:
-                    trip = G_TRIPS[current_trip_id]
-                    arr_time = trip.arrival_times[pos]
-                    
-                    if arr_time < min(best_arrival[stop_id], best_arrival[target_stop_id]):
-                        arrival_times[k][stop_id] = arr_time
-                        best_arrival[stop_id] = arr_time
-                        marked_stops.add(stop_id)
-                        parent_pointers[k][stop_id] = (boarding_stop, current_trip_id, boarding_stop, 'transit', boarding_time, arr_time)
-                
-                prev_round_arrival = arrival_times[k-1][stop_id]
-                if prev_round_arrival < float('inf'):
-                    # Apply transfer buffer
-                    min_dep = prev_round_arrival + (TRANSFER_BUFFER if k > 1 else 0)
-                    
-                    # High-Speed Binary Search using cache
-                    if route_id in G_ROUTE_STOP_TIMES_CACHE and pos < len(G_ROUTE_STOP_TIMES_CACHE[route_id]):
-                        r_times = G_ROUTE_STOP_TIMES_CACHE[route_id][pos]
-                        idx = bisect_left(r_times, min_dep)
-                        
-                        if idx < len(r_times):
-                            new_trip_id = route.trips[idx]
-                            new_boarding_time = r_times[idx]
-                            if current_trip_id is None or new_boarding_time < boarding_time:
-                                current_trip_id = new_trip_id
-                                boarding_stop = stop_id
-                                boarding_time = new_boarding_time
+        updated_by_round.append(marked_stops)
+        parent_stop = G_PARENT_STOP[k]
+        parent_trip = G_PARENT_TRIP[k]
+        parent_dep = G_PARENT_DEP[k]
+        labels = arrival_times[k]
+        for route in scan_order:
+            # PRUNING: Early pruning per route
+            # The target label tightens while the round runs; once even the route's
+            # best boarding cannot beat it, _scan_route would prune every boarding,
+            # so the route is skipped without walking its stops
+            if route_bound[route] + min_change > best_arrival[target]:
+                continue
+            _scan_route(rs_stop[rs_offset[route]:rs_offset[route + 1]], route_trips[route], routes_to_scan[route],
+                        route_time_offset[route], dep_times, arr_times, min_change,
+                        prev_labels, labels, best_arrival, target,
+                        marked_stops, parent_stop, parent_trip, parent_dep, get_min_time_to_target)
 
         # Footpaths scan
-        for stop_id in list(marked_stops):
-            stop_arrival = arrival_times[k][stop_id]
-            for to_stop_id, walk_time in G_STOPS[stop_id].footpaths:
+        # OPTIMIZATION: Each stop's walks are relaxed over zipped CSR slices, one
+        # C-level copy per array instead of two indexed loads per footpath
+        for stop in list(marked_stops):
+            lo = fp_offset[stop]
+            hi = fp_offset[stop + 1]
+            if lo == hi: continue
+            stop_arrival = labels[stop]
+            for to_stop, walk_time in zip(fp_to[lo:hi], fp_walk[lo:hi]):
                 new_arrival = stop_arrival + walk_time
-                if new_arrival < min(best_arrival[to_stop_id], best_arrival[target_stop_id]):
-                    arrival_times[k][to_stop_id] = new_arrival
-                    best_arrival[to_stop_id] = new_arrival
-                    marked_stops.add(to_stop_id)
-                    parent_pointers[k][to_stop_id] = (stop_id, None, None, 'walk', stop_arrival, new_arrival)
+                if new_arrival < best_arrival[to_stop] and new_arrival < best_arrival[target]:
+                    labels[to_stop] = new_arrival
+                    best_arrival[to_stop] = new_arrival
+                    marked_stops.add(to_stop)
+                    parent_stop[to_stop] = stop
+                    parent_trip[to_stop] = None
+                    parent_dep[to_stop] = stop_arrival
         
         if not marked_stops: break
             
     raw_journeys = []
-    for k in range(1, max_rounds + 1):
-        arr = arrival_times[k][target_stop_id]
-        if arr < float('inf'):
+    for k in range(1, len(updated_by_round)):
+        arr = arrival_times[k][target]
+        if arr < INF:
             raw_journeys.append({
                 'arrival_time': arr,
                 'num_transfers': k - 1,
@@ -163,7 +322,7 @@ def run_raptor_worker(source_stop_id, target_stop_id, departure_time_seconds):
     final_journeys = _filter_pareto_optimal(raw_journeys)
     results = []
     for j in final_journeys:
-        path = _reconstruct_path(target_stop_id, j['round'], parent_pointers, source_stop_id)
+        path = _reconstruct_path(target, j['round'], source)
         if path:
             results.append({
                 'arrival_time': j['arrival_time'],
@@ -172,6 +331,62 @@ def run_raptor_worker(source_stop_id, target_stop_id, departure_time_seconds):
             })
     return {'journeys': results}
 
+def _scan_route(stops, trips, start_pos, base, dep_times, arr_times, min_change,
+                prev_arrivals, arrivals, best_arrival, target, marked_stops,
+                parent_stop, parent_trip, parent_dep, min_time_to_target):
+    """
+    Route-scan kernel for one RAPTOR round. Walks the route's stop indices from
+    start_pos over its block of the flat dep/arr arrays (starting at base),
+    boarding the earliest catchable trip and writing improved arrivals into
+    arrivals, best_arrival and the parent arrays. Boardings that cannot beat the target's
+    label under the A* bound are skipped. Every input is passed in, so the loop
+    body only touches locals.
+    """
+    INF = float('inf')
+    n_trips = len(trips)
+    current_trip = -1  # index into route.trips; -1 = not on board
+    boarding_stop = None
+    boarding_time = None
+    
+    for pos in range(start_pos, len(stops)):
+        stop = stops[pos]
+        # This stop's column of the route block in the flat dep/arr arrays
+        lo = base + pos * n_trips
+        if current_trip >= 0:
+            arr_time = arr_times[lo + current_trip]
+            
+            # Two plain comparisons instead of a call to the min() builtin
+            if arr_time < best_arrival[stop] and arr_time < best_arrival[target]:
+                arrivals[stop] = arr_time
+                best_arrival[stop] = arr_time
+                marked_stops.add(stop)
+                parent_stop[stop] = boarding_stop
+                parent_trip[stop] = trips[current_trip]
+                parent_dep[stop] = boarding_time
+        
+        prev_round_arrival = prev_arrivals[stop]
+        if prev_round_arrival < INF:
+            min_dep = prev_round_arrival + min_change
+            
+            # PRUNING: A* bound at boarding
+            # Any ride from this stop reaches the target no earlier than
+            # min_dep + min_time_to_target(stop); if that already loses to the
+            # target's label, neither boarding nor switching trips here can help
+            best_target_arr = best_arrival[target]
+            if best_target_arr < INF and min_dep + min_time_to_target(stop) > best_target_arr:
+                continue
+            
+            # High-Speed Binary Search over this stop's slice of the flat departure array
+            hi = lo + n_trips
+            idx = bisect_left(dep_times, min_dep, lo, hi)
+            
+            if idx < hi:
+                new_boarding_time = dep_times[idx]
+                if current_trip < 0 or new_boarding_time < boarding_time:
+                    current_trip = idx - lo
+                    boarding_stop = stop
+                    boarding_time = new_boarding_time
+
 def _filter_pareto_optimal(journeys):
     if not journeys: return []
     journeys.sort(key=lambda x: x['arrival_time'])
@@ -187,18 +402,22 @@ def _filter_pareto_optimal(journeys):
             pareto.append(j)
     return pareto
 
-def _reconstruct_path(target_stop_id, last_round, parent_pointers, source_stop_id):
+def _reconstruct_path(target, last_round, source):
     path = []
-    current_stop = target_stop_id
+    current_stop = target
     current_round = last_round
     
-    while current_stop != source_stop_id:
+    while current_stop != source:
         if current_round <= 0: break
         
-        if current_stop in parent_pointers[current_round]:
-            prev_stop, trip_id, board_stop, link_type, dep_t, arr_t = parent_pointers[current_round][current_stop]
+        prev_stop = G_PARENT_STOP[current_round][current_stop]
+        if prev_stop >= 0:
+            # The parent was written together with the label, so the label is the arrival
+            trip_id = G_PARENT_TRIP[current_round][current_stop]
+            dep_t = G_PARENT_DEP[current_round][current_stop]
+            arr_t = G_ROUND_LABELS[current_round][current_stop]
             
-            if link_type == 'transit':
+            if trip_id is not None:
                 trip = G_TRIPS[trip_id]
                 route = G_ROUTES[trip.route_id]
                 path.append({
@@ -207,19 +426,19 @@ def _reconstruct_path(target_stop_id, last_round, parent_pointers, source_stop_i
                     'route_id': trip.route_id,
                     'route_name': route.route_name,
                     'agency_id': route.agency_id,
-                    'from_stop_id': board_stop,
-                    'to_stop_id': current_stop,
+                    'from_stop_id': G_STOP_IDS[prev_stop],
+                    'to_stop_id': G_STOP_IDS[current_stop],
                     'departure_time': dep_t,
                     'arrival_time': arr_t,
                     'shape_id': trip.shape_id
                 })
-                current_stop = board_stop
+                current_stop = prev_stop
                 current_round -= 1 
             else:
                 path.append({
                     'type': 'walk',
-                    'from_stop_id': prev_stop,
-                    'to_stop_id': current_stop,
+                    'from_stop_id': G_STOP_IDS[prev_stop],
+                    'to_stop_id': G_STOP_IDS[current_stop],
                     'departure_time': dep_t,
                     'arrival_time': arr_t
                 })
@@ -261,50 +480,185 @@ class TransitRoute:
         self.trips = []
 
 class RaptorRouter:
-    def __init__(self, stops_dict, routes_dict, trips_dict, shapes_dict=None):
+    def __init__(self, stops_dict, routes_dict, trips_dict, shapes_dict=None,
+                 query_cache_size=4096, query_cache_bucket=1):
         self.stops = stops_dict        # {stop_id: TransitStop}
         self.routes = routes_dict      # {route_id: TransitRoute}
         self.trips = trips_dict        # {trip_id: TransitTrip}
         self.shapes = shapes_dict or {} 
         
+        # LRU of worker query futures keyed by (source, target, departure // bucket).
+        # A bucket of 1 keeps results exact; a rebuilt router starts with an empty cache.
+        self.query_cache = OrderedDict()
+        # query_range may run on several server threads at once; the per-query
+        # labels live in the worker processes, so this LRU is the only shared state
+        self.query_cache_lock = threading.Lock()
+        self.query_cache_size = query_cache_size
+        self.query_cache_bucket = query_cache_bucket
+        
         # Build reverse mapping
         print("Building acceleration structures...")
-        self.stop_to_routes = self._build_stop_to_routes()
-        self.route_stop_index = self._build_route_stop_index()
-        self.route_stop_times_cache = self._build_trip_times_cache()
+        self._build_stop_index()
+        self.route_ids = list(self.routes)
+        self.route_stops = [tuple(self.stop_index[sid] for sid in self.routes[rid].stops) for rid in self.route_ids]
+        self.route_trips = [self.routes[rid].trips for rid in self.route_ids]
+        # The same route stop sequences flattened to CSR for the workers
+        self.rs_offset = array('i', [0])
+        self.rs_stop = array('i')
+        for stops in self.route_stops:
+            self.rs_stop.extend(stops)
+            self.rs_offset.append(len(self.rs_stop))
+        self.sr_offset, self.sr_route, self.sr_pos = self._build_stop_routes()
+        self.dep_times, self.arr_times, self.route_time_offset, self.route_fifo = self._build_timetable()
+        
+        # Every flat int array goes to the workers in one shared memory block;
+        # only the object graphs (ids, routes, trips) are still pickled
+        self.shared_shm, self.shared_layout = share_arrays({
+            'stop_lat_rad': self.stop_lat_rad, 'stop_lon_rad': self.stop_lon_rad,
+            'stop_cos_lat': self.stop_cos_lat,
+            'fp_offset': self.fp_offset, 'fp_to': self.fp_to, 'fp_walk': self.fp_walk,
+            'rs_offset': self.rs_offset, 'rs_stop': self.rs_stop,
+            'sr_offset': self.sr_offset, 'sr_route': self.sr_route, 'sr_pos': self.sr_pos,
+            'dep_times': self.dep_times, 'arr_times': self.arr_times,
+            'route_time_offset': self.route_time_offset,
+        })
+        weakref.finalize(self, release_shared, self.shared_shm)
         
         # Initialize Process Pool
         print(f"Initializing Process Pool with {os.cpu_count()} workers...")
         self.executor = ProcessPoolExecutor(
             max_workers=os.cpu_count(),
             initializer=init_worker,
-            initargs=(self.stops, self.routes, self.trips, self.stop_to_routes, self.route_stop_index, self.route_stop_times_cache)
+            initargs=(self.stop_ids, self.routes, self.route_trips, self.trips,
+                      self.shared_shm.name, self.shared_layout)
         )
         print("Process Pool Ready.")
     
-    def _build_trip_times_cache(self):
-        cache = {}
-        for rid, route in self.routes.items():
-            cache[rid] = []
-            for pos in range(len(route.stops)):
-                stop_times = [self.trips[tid].departure_times[pos] for tid in route.trips]
-                cache[rid].append(stop_times)
-        return cache
+    def _build_timetable(self):
+        # All routes' stop events as two parallel int32 arrays (structure of arrays).
+        # A route's block is stop-major: times[offset + pos * n_trips + trip_idx],
+        # so every stop's departure column is a contiguous slice and the worker
+        # reads packed ints instead of per-trip Python lists.
+        # Trips are ordered by their first departure only; a trip that overtakes
+        # another leaves later columns unsorted. fifo[route] is True only when
+        # every column of the route was verified sorted, i.e. safe to bisect.
+        dep_times = array('i')
+        arr_times = array('i')
+        offsets = array('i')
+        fifo = []
+        for route_trips, stops in zip(self.route_trips, self.route_stops):
+            offsets.append(len(dep_times))
+            trips = [self.trips[tid] for tid in route_trips]
+            is_fifo = True
+            for pos in range(len(stops)):
+                column = [trip.departure_times[pos] for trip in trips]
+                if is_fifo and any(a > b for a, b in zip(column, column[1:])):
+                    is_fifo = False
+                dep_times.extend(column)
+                arr_times.extend([trip.arrival_times[pos] for trip in trips])
+            fifo.append(is_fifo)
+        return dep_times, arr_times, offsets, fifo
     
-    def _build_stop_to_routes(self):
-        mapping = defaultdict(list)
-        for route_id, route in self.routes.items():
+    def _build_stop_index(self):
+        # Dense integer ids for every stop: stops.txt entries first, then any stop
+        # only referenced by stop_times. Workers keep their labels in flat lists indexed by them.
+        self.stop_ids = list(self.stops)
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        for route in self.routes.values():
             for stop_id in route.stops:
-                mapping[stop_id].append(route_id)
-        return dict(mapping)
+                if stop_id not in self.stop_index:
+                    self.stop_index[stop_id] = len(self.stop_ids)
+                    self.stop_ids.append(stop_id)
+        
+        # Stops without coordinates get NaN, which makes the A* bound comparison
+        # false so they are simply never pruned
+        # Contiguous float64 arrays; the radians/cos(lat) forms feed the workers' A* bound
+        nan = float('nan')
+        self.stop_lat = array('d', [self.stops[sid].lat if sid in self.stops else nan for sid in self.stop_ids])
+        self.stop_lon = array('d', [self.stops[sid].lon if sid in self.stops else nan for sid in self.stop_ids])
+        self.stop_lat_rad = array('d', map(math.radians, self.stop_lat))
+        self.stop_lon_rad = array('d', map(math.radians, self.stop_lon))
+        self.stop_cos_lat = array('d', map(math.cos, self.stop_lat_rad))
+        
+        # Footpaths flattened to CSR: one offsets array plus parallel target/duration
+        # arrays, so a stop's walks are a contiguous range instead of a tuple of tuples
+        self.fp_offset = array('i', [0])
+        self.fp_to = array('i')
+        self.fp_walk = array('i')
+        for sid in self.stop_ids:
+            if sid in self.stops:
+                for nb_id, walk_time in self.stops[sid].footpaths:
+                    self.fp_to.append(self.stop_index[nb_id])
+                    self.fp_walk.append(walk_time)
+            self.fp_offset.append(len(self.fp_to))
+    
+    def _build_stop_routes(self):
+        # Stop -> (route index, pos) pairs as CSR int arrays: one offsets array plus
+        # parallel route/position arrays, so a stop's routes are a contiguous range
+        # of packed ints instead of a tuple of tuples
+        stop_routes = [[] for _ in self.stop_ids]
+        for route, stops in enumerate(self.route_stops):
+            for pos, stop in enumerate(stops):
+                stop_routes[stop].append((route, pos))
+        sr_offset = array('i', [0])
+        sr_route = array('i')
+        sr_pos = array('i')
+        for entries in stop_routes:
+            for route, pos in entries:
+                sr_route.append(route)
+                sr_pos.append(pos)
+            sr_offset.append(len(sr_route))
+        return sr_offset, sr_route, sr_pos
     
-    def _build_route_stop_index(self):
-        index = {}
-        for route_id, route in self.routes.items():
-            index[route_id] = {stop_id: pos for pos, stop_id in enumerate(route.stops)}
-        return index
+    def routes_at(self, stop_id):
+        """[(route index, pos), ...] for every route that stops at stop_id."""
+        stop = self.stop_index.get(stop_id)
+        if stop is None:
+            return []
+        lo, hi = self.sr_offset[stop], self.sr_offset[stop + 1]
+        return list(zip(self.sr_route[lo:hi], self.sr_pos[lo:hi]))
     
+    def is_served(self, stop_id, via_footpaths=False):
+        """
+        True if any route stops at stop_id (or, with via_footpaths, at a stop
+        within walking distance of it). A RAPTOR query can only leave a source
+        that is served, and only reach a target served directly or via a footpath,
+        so callers use this to skip queries that are guaranteed to come back empty.
+        """
+        if self.routes_at(stop_id):
+            return True
+        if via_footpaths and stop_id in self.stops:
+            return any(self.routes_at(nb_id) for nb_id, _ in self.stops[stop_id].footpaths)
+        return False
+
+    def submit_query(self, source_stop_id, target_stop_id, departure_time_seconds):
+        """
+        Submits run_raptor_worker to the pool, memoized in an LRU.
+        The future itself is cached, so a repeat query (also one still in flight)
+        shares the same result instead of running the round loop again.
+        """
+        key = (source_stop_id, target_stop_id, departure_time_seconds // self.query_cache_bucket)
+        with self.query_cache_lock:
+            future = self.query_cache.get(key)
+            if future is not None:
+                # A cancelled or failed future is evicted and the query resubmitted;
+                # exception() on a cancelled future would raise CancelledError itself
+                if future.cancelled() or (future.done() and future.exception() is not None):
+                    del self.query_cache[key]
+                else:
+                    self.query_cache.move_to_end(key)
+                    return future
+            
+            future = self.executor.submit(run_raptor_worker, source_stop_id, target_stop_id, departure_time_seconds)
+            self.query_cache[key] = future
+            if len(self.query_cache) > self.query_cache_size:
+                self.query_cache.popitem(last=False)
+            return future
+
     def query_range(self, source_stop_id, target_stop_id, start_time_seconds, window=3600):
+        # A trip to the stop you are at has no journeys; don't run up to 100 solves to find that out
+        if source_stop_id == target_stop_id:
+            return {'journeys': []}
         if source_stop_id not in self.stops or target_stop_id not in self.stops:
             return {'journeys': []}
 
@@ -319,13 +673,22 @@ class RaptorRouter:
         ]
 
         def find_opps(target_stop_id, offset_t):
-            for route_id in self.stop_to_routes.get(target_stop_id, []):
-                route = self.routes[route_id]
-                pos = self.route_stop_index[route_id][target_stop_id]
-                for tid in route.trips:
-                    if not self.trips[tid].departure_times: continue
-                    dep = self.trips[tid].departure_times[pos]
-                    for w_start, w_end in search_windows:
+            dep_times = self.dep_times
+            for route, pos in self.routes_at(target_stop_id):
+                n_trips = len(self.route_trips[route])
+                # The stop's departures are a contiguous slice of the flat array.
+                # On a FIFO route the slice is sorted, so each window is located by
+                # binary search; otherwise the whole slice is scanned
+                lo = self.route_time_offset[route] + pos * n_trips
+                hi = lo + n_trips
+                for w_start, w_end in search_windows:
+                    if self.route_fifo[route]:
+                        first = bisect_left(dep_times, w_start, lo, hi)
+                        last = bisect_right(dep_times, w_end, lo, hi)
+                    else:
+                        first, last = lo, hi
+                    for i in range(first, last):
+                        dep = dep_times[i]
                         if w_start <= dep <= w_end:
                             opportunities.append((dep, target_stop_id))
 
@@ -356,7 +719,7 @@ class RaptorRouter:
         futures = []
         for dep_t in unique_start_times:
             # submit(fn, *args)
-            futures.append(self.executor.submit(run_raptor_worker, source_stop_id, target_stop_id, dep_t))
+            futures.append(self.submit_query(source_stop_id, target_stop_id, dep_t))
             
         # Collect results
         query_results = [f.result() for f in futures]
@@ -385,70 +748,112 @@ def load_all_data(data_dir, window_start=None, window_end=None):
     trips_dict = {}
     shapes_dict = {}
     
+    # GTFS feeds repeat the same few thousand clock strings across millions of
+    # stop_times rows, so each distinct string is parsed once
+    @lru_cache(maxsize=None)
     def to_sec(t):
         if not t: return 0
+        # Fast path for the fixed-width HH:MM:SS form: three slices, no list from split
+        if len(t) == 8 and t[2] == ':' and t[5] == ':':
+            return int(t[0:2]) * 3600 + int(t[3:5]) * 60 + int(t[6:8])
         parts = t.split(':')
         h = int(parts[0])
         m = int(parts[1])
         s = int(parts[2]) if len(parts) > 2 else 0
         return h * 3600 + m * 60 + s
 
-    for operator in os.listdir(data_dir):
-        op_path = os.path.join(data_dir, operator)
-        if not os.path.isdir(op_path): continue
+    # One scandir pass per directory: DirEntry caches the file type, so there is
+    # no separate isdir/exists stat call for each operator and each GTFS file
+    with os.scandir(data_dir) as it:
+        operator_dirs = [entry for entry in it if entry.is_dir()]
+
+    for op_entry in operator_dirs:
+        operator = op_entry.name
+        with os.scandir(op_entry.path) as it:
+            gtfs_files = {entry.name: entry.path for entry in it if entry.is_file()}
+        
+        # raw id -> prefixed "operator:id" string, built once per distinct id. Later
+        # files reuse these objects instead of formatting a new string on every row,
+        # so each id is stored once and dict lookups on it match by identity
+        stop_keys = {}
+        route_keys = {}
+        trip_keys = {}
         
-        stops_file = os.path.join(op_path, 'stops.txt')
-        if os.path.exists(stops_file):
+        stops_file = gtfs_files.get('stops.txt')
+        if stops_file:
             with open(stops_file, encoding='utf-8-sig') as f:
                 for row in csv.DictReader(f):
-                    sid = f"{operator}:{row['stop_id']}"
+                    sid = stop_keys[row['stop_id']] = f"{operator}:{row['stop_id']}"
                     stops_dict[sid] = TransitStop(sid, row['stop_name'], float(row['stop_lat']), float(row['stop_lon']), operator)
 
-        routes_file = os.path.join(op_path, 'routes.txt')
-        if os.path.exists(routes_file):
+        routes_file = gtfs_files.get('routes.txt')
+        if routes_file:
             with open(routes_file, encoding='utf-8-sig') as f:
                 for row in csv.DictReader(f):
-                    rid = f"{operator}:{row['route_id']}"
+                    rid = route_keys[row['route_id']] = f"{operator}:{row['route_id']}"
                     name = row.get('route_short_name') or row.get('route_long_name') or rid
                     routes_base[rid] = {"name": name, "agency": operator}
 
-        shapes_file = os.path.join(op_path, 'shapes.txt')
-        if os.path.exists(shapes_file):
+        # raw shape_id -> the prefixed key object stored in shapes_dict. Trips reuse
+        # that exact string, so each shape id exists once in memory and leg lookups
+        # into shapes_dict hit the identity fast path of the dict key compare
+        shape_keys = {}
+        shapes_file = gtfs_files.get('shapes.txt')
+        if shapes_file:
              with open(shapes_file, encoding='utf-8-sig') as f:
                 temp_shapes = defaultdict(list)
                 for row in csv.DictReader(f):
-                    shape_id = f"{operator}:{row['shape_id']}"
-                    temp_shapes[shape_id].append((float(row['shape_pt_lat']), float(row['shape_pt_lon']), int(row['shape_pt_sequence'])))
-                for sid, pts in temp_shapes.items():
+                    temp_shapes[row['shape_id']].append((float(row['shape_pt_lat']), float(row['shape_pt_lon']), int(row['shape_pt_sequence'])))
+                # Prefix once per shape instead of once per shape point
+                for raw_id, pts in temp_shapes.items():
                     pts.sort(key=lambda x: x[2])
-                    shapes_dict[sid] = [(p[0], p[1]) for p in pts]
+                    shape_id = f"{operator}:{raw_id}"
+                    shape_keys[raw_id] = shape_id
+                    shapes_dict[shape_id] = [(p[0], p[1]) for p in pts]
 
-        trips_file = os.path.join(op_path, 'trips.txt')
-        if os.path.exists(trips_file):
+        trips_file = gtfs_files.get('trips.txt')
+        if trips_file:
             with open(trips_file, encoding='utf-8-sig') as f:
                 for row in csv.DictReader(f):
-                    tid = f"{operator}:{row['trip_id']}"
-                    rid = f"{operator}:{row['route_id']}"
+                    tid = trip_keys[row['trip_id']] = f"{operator}:{row['trip_id']}"
+                    rid = route_keys.get(row['route_id']) or f"{operator}:{row['route_id']}"
                     trip = TransitTrip(tid, rid, row.get('service_id'))
-                    if row.get('shape_id'):
-                        trip.shape_id = f"{operator}:{row['shape_id']}"
+                    raw_shape_id = row.get('shape_id')
+                    if raw_shape_id:
+                        trip.shape_id = shape_keys.get(raw_shape_id) or f"{operator}:{raw_shape_id}"
                     trips_dict[tid] = trip
 
-        st_file = os.path.join(op_path, 'stop_times.txt')
-        if os.path.exists(st_file):
+        st_file = gtfs_files.get('stop_times.txt')
+        if st_file:
             with open(st_file, encoding='utf-8-sig') as f:
+                # stop_times is by far the largest file: read plain lists and resolve
+                # the columns once from the header instead of building a dict per row
+                reader = csv.reader(f)
+                header = next(reader, [])
+                i_trip = header.index('trip_id')
+                i_stop = header.index('stop_id')
+                i_arr = header.index('arrival_time')
+                i_dep = header.index('departure_time')
+                i_seq = header.index('stop_sequence')
+                
+                # Single pass over the file: buffer only the four needed fields as a
+                # compact (sequence, stop, arrival, departure) tuple per row
                 trip_stop_times = defaultdict(list)
-                for row in csv.DictReader(f):
-                    tid = f"{operator}:{row['trip_id']}"
-                    if tid in trips_dict:
-                        trip_stop_times[tid].append(row)
+                for row in reader:
+                    if not row: continue  # DictReader skipped blank lines too
+                    # Only trips listed in this operator's trips.txt are kept
+                    tid = trip_keys.get(row[i_trip])
+                    if tid is not None:
+                        trip_stop_times[tid].append((int(row[i_seq]), row[i_stop], row[i_arr], row[i_dep]))
                 
+                # Then organize each trip from memory, unzipping its sorted tuples once
                 for tid, rows in trip_stop_times.items():
-                    rows.sort(key=lambda x: int(x['stop_sequence']))
+                    rows.sort(key=itemgetter(0))
+                    _, stop_ids, arr_strs, dep_strs = zip(*rows)
                     trip = trips_dict[tid]
-                    trip.stop_sequence = [f"{operator}:{r['stop_id']}" for r in rows]
-                    trip.arrival_times = [to_sec(r['arrival_time']) for r in rows]
-                    trip.departure_times = [to_sec(r['departure_time']) for r in rows]
+                    trip.stop_sequence = [stop_keys.get(sid) or f"{operator}:{sid}" for sid in stop_ids]
+                    trip.arrival_times = [to_sec(t) for t in arr_strs]
+                    trip.departure_times = [to_sec(t) for t in dep_strs]
 
     # FILTER TRIPS (Dynamic Window)
     if window_start is not None and window_end is not None:
@@ -478,43 +883,64 @@ def load_all_data(data_dir, window_start=None, window_end=None):
     for tid, trip in trips_dict.items():
         if not trip.stop_sequence: continue
         
-        pattern = tuple(trip.stop_sequence)
         base_rid = trip.route_id
+        # The key tuple is hashed over every stop of the trip, so it is built and
+        # looked up exactly once per trip; the route object comes back with its id
+        key = (base_rid, tuple(trip.stop_sequence))
+        entry = pattern_to_route_id.get(key)
         
-        if (base_rid, pattern) not in pattern_to_route_id:
+        if entry is None:
             unique_rid = f"{base_rid}:p{len(pattern_to_route_id)}"
             base_info = routes_base.get(base_rid, {"name": "Unknown", "agency": "Unknown"})
             new_route = TransitRoute(unique_rid, base_info['agency'], base_info['name'])
-            new_route.stops = list(pattern)
+            new_route.stops = list(key[1])
             final_routes[unique_rid] = new_route
-            pattern_to_route_id[(base_rid, pattern)] = unique_rid
+            entry = pattern_to_route_id[key] = (unique_rid, new_route)
             
-        unique_rid = pattern_to_route_id[(base_rid, pattern)]
+        unique_rid, route = entry
         trip.route_id = unique_rid 
-        final_routes[unique_rid].trips.append(tid)
+        route.trips.append(tid)
 
+    # Sort each route's trips by their first stop event (departure, then arrival).
+    # Keys are precomputed once, so the sort compares plain int tuples via a C-level
+    # dict lookup instead of calling a Python lambda per trip
+    first_event = {tid: (trip.departure_times[0], trip.arrival_times[0])
+                   for tid, trip in trips_dict.items() if trip.stop_sequence}
     for rid, route in final_routes.items():
-        route.trips.sort(key=lambda tid: trips_dict[tid].departure_times[0])
+        route.trips.sort(key=first_event.__getitem__)
 
     print("Computing footpaths using spatial grid...")
     grid = defaultdict(list)
     grid_size = 0.005 
     
+    # OPTIMIZATION: Unit-sphere ECEF coordinates per stop, computed once.
+    # A pair's great-circle distance is then 2R*asin(chord/2) from the 3D chord
+    # length - the same value haversine gives, without per-pair trig on lat/lon.
+    R = 6371  # km, as in haversine
+    ecef = {}
+    for sid, stop in stops_dict.items():
+        lat = math.radians(stop.lat)
+        lon = math.radians(stop.lon)
+        ecef[sid] = (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+    
     for sid, stop in stops_dict.items():
         gx = int(stop.lat / grid_size)
         gy = int(stop.lon / grid_size)
-        grid[(gx, gy)].append(stop)
+        grid[(gx, gy)].append((stop, ecef[sid]))
         
+    asin, sqrt = math.asin, math.sqrt
     for sid, stop in stops_dict.items():
         gx = int(stop.lat / grid_size)
         gy = int(stop.lon / grid_size)
+        x1, y1, z1 = ecef[sid]
         
         for dx in range(-1, 2):
             for dy in range(-1, 2):
                 neighbor_stops = grid.get((gx + dx, gy + dy), [])
-                for other in neighbor_stops:
+                for other, (x2, y2, z2) in neighbor_stops:
                     if sid == other.stop_id: continue
-                    dist = haversine(stop.lat, stop.lon, other.lat, other.lon)
+                    chord = sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2)
+                    dist = 2 * R * asin(min(1.0, chord / 2))
                     if dist < 5.0:
                         walk_time = int((dist / 1.1) * 1000)
                         stop.footpaths.append((other.stop_id, walk_time))
@@ -522,12 +948,65 @@ def load_all_data(data_dir, window_start=None, window_end=None):
     print(f"Footpaths computed for {len(stops_dict)} stops.")
     return stops_dict, final_routes, trips_dict, shapes_dict
 
+# Bump whenever load_all_data's output changes (parsing, footpaths, object layout),
+# so caches written by older code are rebuilt instead of reused
+GTFS_CACHE_VERSION = 1
+
+def _gtfs_signature(data_dir, window_start, window_end):
+    """
+    Cache format version, the load window and (name, size, mtime) of every GTFS
+    file; any change invalidates the cache.
+    """
+    signature = [GTFS_CACHE_VERSION, window_start, window_end]
+    with os.scandir(data_dir) as it:
+        operator_dirs = sorted((entry for entry in it if entry.is_dir()), key=lambda e: e.name)
+    for op_entry in operator_dirs:
+        with os.scandir(op_entry.path) as it:
+            for entry in sorted(it, key=lambda e: e.name):
+                if entry.is_file():
+                    st = entry.stat()
+                    signature.append((op_entry.name, entry.name, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+def load_all_data_cached(data_dir, cache_file, window_start=None, window_end=None):
+    """
+    load_all_data behind a pickle cache. The file holds the GTFS signature followed
+    by the parsed data, both written with the highest pickle protocol; it is
+    rebuilt whenever the signature no longer matches.
+    """
+    signature = _gtfs_signature(data_dir, window_start, window_end)
+    try:
+        with open(cache_file, 'rb') as f:
+            if pickle.load(f) == signature:
+                print(f"Loading parsed GTFS data from cache {cache_file}...")
+                return pickle.load(f)
+    except Exception as e:
+        # Missing, truncated or written by incompatible code (unpickling can raise
+        # almost anything then): parse from scratch and overwrite it
+        if not isinstance(e, FileNotFoundError):
+            print(f"WARNING: ignoring unreadable GTFS cache {cache_file}: {e!r}")
+
+    data = load_all_data(data_dir, window_start, window_end)
+    tmp_file = cache_file + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(signature, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)  # readers never see a half-written cache
+    except OSError as e:
+        print(f"WARNING: could not write GTFS cache {cache_file}: {e}")
+    return data
+
+# Module-level names for haversine: global loads instead of math.* attribute lookups
+_sin, _cos, _sqrt, _atan2 = math.sin, math.cos, math.sqrt, math.atan2
+_DEG_TO_RAD = math.pi / 180  # the factor math.radians multiplies by
+
 def haversine(lat1, lon1, lat2, lon2):
+    # OPTIMIZATION: Each half-angle sine is computed once and squared, and degrees
+    # are converted by one multiply; results are bit-identical to the math.radians form
     R = 6371 
-    dLat = math.radians(lat2 - lat1)
-    dLon = math.radians(lon2 - lon1)
-    a = math.sin(dLat/2) * math.sin(dLat/2) + \
-        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * \
-        math.sin(dLon/2) * math.sin(dLon/2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    s_lat = _sin((lat2 - lat1) * _DEG_TO_RAD / 2)
+    s_lon = _sin((lon2 - lon1) * _DEG_TO_RAD / 2)
+    a = s_lat * s_lat + _cos(lat1 * _DEG_TO_RAD) * _cos(lat2 * _DEG_TO_RAD) * s_lon * s_lon
+    c = 2 * _atan2(_sqrt(a), _sqrt(1-a))
     return R * c
@@ -1,16 +1,36 @@
 import uvicorn
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
 from pytz import timezone
 import os
+import gzip
+import hashlib
+import json
 import socketio
 
-from raptor_engine import load_all_data, RaptorRouter, CALIF_TZ, TransitStop, TransitTrip, TransitRoute, haversine, run_raptor_worker
+try:
+    # orjson serializes the large nested journey lists several times faster than stdlib json
+    import orjson
+    def dumps_json(obj):
+        # Non-str dict keys are stringified, as the stdlib encoder does
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def dumps_json(obj):
+        # Same output as Starlette's JSONResponse.render
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps_json (orjson when it is installed)."""
+    def render(self, content):
+        return dumps_json(content)
+
+from raptor_engine import load_all_data, load_all_data_cached, RaptorRouter, CALIF_TZ, TransitStop, TransitTrip, TransitRoute, haversine
 import math
+from collections import defaultdict, OrderedDict
 
 import asyncio
 from contextlib import asynccontextmanager
@@ -20,11 +40,53 @@ last_synced_hour = -1
 carpool_counter = 0
 carpool_routes_cache = {}  # route_id -> {stop_ids, dep_times, arr_times, trip_id}
 
+# LRU of serialized /api/route (body, etag) pairs keyed by (source, target, departure seconds).
+# Cleared by invalidate_route_cache whenever the router or the carpool routes change.
+ROUTE_CACHE_SIZE = int(os.environ.get('RAPTOR_ROUTE_CACHE_SIZE', '1024'))
+route_cache = OrderedDict()
+route_cache_version = 0
+
+# Max multimodal journeys logged per /api/route request (the rest are only counted)
+PRINT_HEAD = int(os.environ.get('RAPTOR_PRINT_HEAD', '5'))
+
+def invalidate_route_cache():
+    """Drops cached /api/route bodies; a request already in flight will not store its stale result."""
+    global route_cache_version
+    route_cache.clear()
+    route_cache_version += 1
+
 # Socket.IO Setup
 sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
 
+def load_network():
+    """
+    Loads the GTFS data, builds the router and every per-stop lookup, and
+    writes the static GeoJSON files. Blocking; background_sync_task runs it in a thread so the event loop keeps
+    answering (e.g. /api/status) during the load.
+    """
+    # No start/end seconds => loads ALL trips for the current day
+    if CACHE_FILE:
+        stops, routes, trips, shapes = load_all_data_cached(DATA_DIR, CACHE_FILE)
+    else:
+        stops, routes, trips, shapes = load_all_data(DATA_DIR)
+    router = RaptorRouter(stops, routes, trips, shapes)
+    geojson = build_geojson_payload(stops)
+    if STATIC_DIR:
+        try:
+            write_static_geojson(geojson, STATIC_DIR)
+        except OSError as e:
+            # The API still serves the payload from memory
+            print(f"WARNING: could not write static GeoJSON to {STATIC_DIR}: {e}")
+    return {
+        'router': router,
+        'stops': stops,
+        'shapes': shapes,
+        'grid': build_stop_grid(stops),
+        'geojson': geojson,
+    }
+
 async def background_sync_task():
-    global router_instance, stops_cache, shapes_cache, last_synced_hour
+    global router_instance, stops_cache, shapes_cache, stop_grid, geojson_payload, last_synced_hour
     
     while True:
         try:
@@ -33,13 +95,15 @@ async def background_sync_task():
                 print("--- LOADING ALL TRIPS (NO TIME WINDOW FILTERING) ---")
                 
                 if os.path.exists(DATA_DIR):
-                    # No start/end seconds => loads ALL trips for the current day
-                    stops, routes, trips, shapes = load_all_data(DATA_DIR)
+                    network = await asyncio.to_thread(load_network)
                     
-                    # Replace global router
-                    router_instance = RaptorRouter(stops, routes, trips, shapes)
-                    stops_cache = stops
-                    shapes_cache = shapes
+                    # Replace global router; all globals switch over together, with no await in between
+                    router_instance = network['router']
+                    stops = stops_cache = network['stops']
+                    shapes_cache = network['shapes']
+                    stop_grid = network['grid']
+                    geojson_payload = network['geojson']
+                    invalidate_route_cache()
                     last_synced_hour = 0  # Mark as loaded
                     print(f"LOAD COMPLETE. Total Stops: {len(stops)}")
                     
@@ -67,7 +131,8 @@ async def lifespan(app: FastAPI):
     
     yield
 
-app = FastAPI(lifespan=lifespan)
+# Every endpoint that returns plain dicts/lists is serialized by orjson when it is installed
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -82,9 +147,16 @@ app.add_middleware(
 socket_app = socketio.ASGIApp(sio, app)
 
 DATA_DIR = r"C:\Users\bilal\Desktop\Raptor\Raptor\gtfs_data"
+# Parsed GTFS is pickled here and reused until a GTFS file changes; set to "" to disable
+CACHE_FILE = os.environ.get('RAPTOR_CACHE_FILE', os.path.join(os.path.dirname(DATA_DIR), 'gtfs_cache.pkl'))
+# The stops GeoJSON (plain + .gz) is also written here for a fronting web server
+# to send as static files (e.g. nginx gzip_static + sendfile); set to "" to disable
+STATIC_DIR = os.environ.get('RAPTOR_STATIC_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
 router_instance = None
 stops_cache = {}
 shapes_cache = {}
+stop_grid = {}
+geojson_payload = None  # (json_bytes, gzip_bytes, etag) for /api/all-stops-geojson
 
 @app.get("/api/status")
 async def get_status():
@@ -100,64 +172,110 @@ async def get_status():
 class CarpoolRouteRequest(BaseModel):
     road_geometry: Optional[List[List[float]]] = None  # list of [lon, lat]
 
-def find_stops_right_of_road(road_geometry, all_stops, buffer_m=400, source_id=None, target_id=None):
+STOP_GRID_CELL_DEG = 0.005           # ~550 m of latitude per cell
+METERS_PER_DEG_LAT = 6371000.0 * math.pi / 180  # same earth radius as haversine
+
+def build_stop_grid(all_stops, cell_deg=STOP_GRID_CELL_DEG):
+    """
+    Buckets stops into an equirectangular lat/lon grid.
+    Cells hold (load_order, stop_id, stop) so candidates can be put back in dict
+    order and used without another lookup in the stops dict.
+    """
+    grid = defaultdict(list)
+    for order, (sid, stop) in enumerate(all_stops.items()):
+        grid[(math.floor(stop.lat / cell_deg), math.floor(stop.lon / cell_deg))].append((order, sid, stop))
+    return grid
+
+def _stops_near_road(road_geometry, grid, buffer_m, cell_deg=STOP_GRID_CELL_DEG):
+    """
+    Grid prefilter for find_stops_right_of_road: every stop within buffer_m of
+    a segment lies inside that segment's bounding box padded by buffer_m, so
+    only the cells overlapping the padded boxes need to be checked.
+    Returns (stop_id, stop) pairs in load order.
+    """
+    # 1% slack covers the small-angle approximation of the longitude padding
+    pad_lat = buffer_m / METERS_PER_DEG_LAT * 1.01
+    candidates = set()
+    for i in range(len(road_geometry) - 1):
+        p1_lon, p1_lat = road_geometry[i]
+        p2_lon, p2_lat = road_geometry[i + 1]
+        lat_lo = min(p1_lat, p2_lat) - pad_lat
+        lat_hi = max(p1_lat, p2_lat) + pad_lat
+        # Pad longitude for the highest latitude in the box, where degrees are shortest
+        max_abs_lat = min(89.0, max(abs(lat_lo), abs(lat_hi)))
+        pad_lon = pad_lat / math.cos(math.radians(max_abs_lat))
+        lon_lo = min(p1_lon, p2_lon) - pad_lon
+        lon_hi = max(p1_lon, p2_lon) + pad_lon
+        for gx in range(math.floor(lat_lo / cell_deg), math.floor(lat_hi / cell_deg) + 1):
+            for gy in range(math.floor(lon_lo / cell_deg), math.floor(lon_hi / cell_deg) + 1):
+                cell = grid.get((gx, gy))
+                if cell:
+                    candidates.update(cell)
+    # load_order is unique, so sorting never has to compare the stop objects
+    return [(sid, stop) for _, sid, stop in sorted(candidates)]
+
+def find_stops_right_of_road(road_geometry, all_stops, buffer_m=400, source_id=None, target_id=None, grid=None):
     """
     Given a road_geometry (list of [lon, lat] from Mapbox Directions),
     find stops that lie within buffer_m of the road AND on the RIGHT side
     of the direction of travel (California right-side traffic).
     Returns list of (stop_id, cum_dist_m) sorted by position along route.
+    grid is a prebuilt build_stop_grid(all_stops); one is built if omitted.
     """
     if not road_geometry or len(road_geometry) < 2:
         return []
 
     # Precompute segment cumulative lengths (meters)
-    seg_lengths = []
+    # OPTIMIZATION: Everything that depends only on the segment (cos(lat) scaling,
+    # scaled direction, squared length) is computed once here instead of once per
+    # candidate stop; degenerate segments are dropped up front
+    segments = []
     cum = 0.0
     for i in range(len(road_geometry) - 1):
         p1_lon, p1_lat = road_geometry[i]
         p2_lon, p2_lat = road_geometry[i + 1]
         seg_len = haversine(p1_lat, p1_lon, p2_lat, p2_lon) * 1000.0  # km -> m
-        seg_lengths.append((cum, seg_len))
+
+        # Scale lon by cos(lat) so degrees are equal-area (critical at CA latitudes ~37N)
+        cos_lat = math.cos(math.radians((p1_lat + p2_lat) / 2))
+        raw_dlon = p2_lon - p1_lon
+        dlat = p2_lat - p1_lat
+        dlon = raw_dlon * cos_lat
+        seg_len_sq = dlon * dlon + dlat * dlat
+        if seg_len_sq >= 1e-18:
+            segments.append((p1_lon, p1_lat, raw_dlon, dlat, cos_lat, dlon, seg_len_sq, cum, seg_len))
         cum += seg_len
-    total_length = cum
 
     results = []
 
-    for sid, stop in all_stops.items():
+    # OPTIMIZATION: Only stops near the road's bounding boxes get the exact
+    # per-segment check, instead of every stop in the network
+    if grid is None:
+        grid = build_stop_grid(all_stops)
+    for sid, stop in _stops_near_road(road_geometry, grid, buffer_m):
         if sid == source_id or sid == target_id:
             continue
+        stop_lat, stop_lon = stop.lat, stop.lon
 
         best_perp_m = float('inf')
         best_cum_dist = 0.0
         best_is_right = False
 
-        for i in range(len(road_geometry) - 1):
-            p1_lon, p1_lat = road_geometry[i]
-            p2_lon, p2_lat = road_geometry[i + 1]
-
-            # Scale lon by cos(lat) so degrees are equal-area (critical at CA latitudes ~37N)
-            cos_lat = math.cos(math.radians((p1_lat + p2_lat) / 2))
-            dlon = (p2_lon - p1_lon) * cos_lat
-            dlat = p2_lat - p1_lat
-            seg_len_sq = dlon * dlon + dlat * dlat
-            if seg_len_sq < 1e-18:
-                continue
-
+        for p1_lon, p1_lat, raw_dlon, dlat, cos_lat, dlon, seg_len_sq, seg_cum, seg_len_m in segments:
             # Project stop onto segment in scaled coordinates
-            px = (stop.lon - p1_lon) * cos_lat
-            py = stop.lat - p1_lat
+            px = (stop_lon - p1_lon) * cos_lat
+            py = stop_lat - p1_lat
             t = max(0.0, min(1.0, (px * dlon + py * dlat) / seg_len_sq))
 
             # Closest point on segment (in real lon/lat)
-            proj_lon = p1_lon + t * (p2_lon - p1_lon)
-            proj_lat = p1_lat + t * (p2_lat - p1_lat)
+            proj_lon = p1_lon + t * raw_dlon
+            proj_lat = p1_lat + t * dlat
 
             # Actual perpendicular distance (meters)
-            perp_m = haversine(stop.lat, stop.lon, proj_lat, proj_lon) * 1000.0
+            perp_m = haversine(stop_lat, stop_lon, proj_lat, proj_lon) * 1000.0
 
             if perp_m < best_perp_m:
                 best_perp_m = perp_m
-                seg_cum, seg_len_m = seg_lengths[i]
                 best_cum_dist = seg_cum + t * seg_len_m
 
                 # Right-side check: cross product in scaled coordinates
@@ -225,9 +343,9 @@ async def create_carpool_route(
     global router_instance, stops_cache, shapes_cache, carpool_counter
 
     if not router_instance:
-        return JSONResponse({"error": "Router not initialized yet"}, status_code=503)
+        return FastJSONResponse({"error": "Router not initialized yet"}, status_code=503)
     if source not in stops_cache or target not in stops_cache:
-        return JSONResponse({"error": "Invalid source or target stop ID"}, status_code=400)
+        return FastJSONResponse({"error": "Invalid source or target stop ID"}, status_code=400)
 
     src_stop = stops_cache[source]
     tgt_stop = stops_cache[target]
@@ -239,7 +357,8 @@ async def create_carpool_route(
         intermediates = find_stops_right_of_road(
             road_geometry, stops_cache,
             buffer_m=400,
-            source_id=source, target_id=target
+            source_id=source, target_id=target,
+            grid=stop_grid
         )
     else:
         # Fallback: no geometry provided, no intermediate stops
@@ -251,8 +370,8 @@ async def create_carpool_route(
     print(f"\n--- CARPOOL ROUTE (ROAD-FOLLOWING) ---")
     print(f"Source: {src_stop.name} | Target: {tgt_stop.name}")
     print(f"Road-side stops picked: {len(intermediates)}")
-    for sid, dist_m in intermediates:
-        print(f"  [{dist_m:.0f}m] {stops_cache[sid].name} ({sid})")
+    if intermediates:
+        print("\n".join(f"  [{dist_m:.0f}m] {stops_cache[sid].name} ({sid})" for sid, dist_m in intermediates))
 
     # 3. Create synthetic route & trip
     carpool_counter += 1
@@ -323,6 +442,7 @@ async def create_carpool_route(
         'trip_id': trip_id,
         'route_name': f"Carpool #{carpool_counter}"
     }
+    invalidate_route_cache()
 
     # 5c. Return carpool route info with geometry for frontend map preview
     stop_details = []
@@ -353,28 +473,123 @@ async def create_carpool_route(
 
 # ===================== END CARPOOL =====================
 
+def stop_feature(sid, stop):
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [stop.lon, stop.lat]
+        },
+        "properties": {
+            "id": sid,
+            "name": stop.name,
+            "agency": stop.agency_id
+        }
+    }
+
+def build_geojson_payload(all_stops):
+    """
+    Serializes the stops FeatureCollection once, plus its gzip form and an ETag.
+    Stops never change after load, so requests just send these bytes.
+    """
+    features = [stop_feature(sid, stop) for sid, stop in all_stops.items()]
+    body, etag = etagged(dumps_json({"type": "FeatureCollection", "features": features}))
+    # Weak ETag: the plain and gzip bodies are the same representation
+    return body, gzip.compress(body, 6), etag
+
+def write_static_geojson(payload, static_dir):
+    """
+    Writes the prebuilt stops payload as all-stops.geojson and all-stops.geojson.gz.
+    Each file is replaced atomically, so a web server never sends a partial one.
+    """
+    os.makedirs(static_dir, exist_ok=True)
+    body, gzip_body, _ = payload
+    for name, data in (("all-stops.geojson", body), ("all-stops.geojson.gz", gzip_body)):
+        path = os.path.join(static_dir, name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+def etagged(body):
+    """(body, weak ETag) for a pre-serialized response body."""
+    return body, f'W/"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+def bytes_response(request, body, etag, headers=None, media_type="application/json"):
+    """
+    Sends pre-serialized bytes as they are (Content-Length comes from the body),
+    or an empty 304 when If-None-Match already names etag. no-cache lets clients
+    keep the copy but revalidate, which costs a 304 while the data is unchanged.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", **(headers or {})}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+def accepts_gzip(accept_encoding):
+    """
+    True if Accept-Encoding allows gzip: listed (or matched by '*' when not
+    listed) with a q-value above 0, so "gzip;q=0" is a refusal.
+    """
+    qvalues = {}
+    for token in (accept_encoding or "").split(","):
+        coding, _, params = token.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    q = qvalues.get("gzip", qvalues.get("*", 0.0))
+    return q > 0
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match check (comma-separated list or '*')."""
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
 @app.get("/api/all-stops-geojson")
-async def get_all_stops():
+async def get_all_stops(request: Request):
     # Defensive check
-    if not stops_cache:
+    if geojson_payload is None:
         print("WARNING: stops_cache is empty during request!")
         return {"type": "FeatureCollection", "features": []}
 
-    features = []
-    for sid, stop in stops_cache.items():
-        features.append({
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": [stop.lon, stop.lat]
-            },
-            "properties": {
-                "id": sid,
-                "name": stop.name,
-                "agency": stop.agency_id
-            }
-        })
-    return {"type": "FeatureCollection", "features": features}
+    body, gzip_body, etag = geojson_payload
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        return bytes_response(request, gzip_body, etag, {"Vary": "Accept-Encoding", "Content-Encoding": "gzip"})
+    return bytes_response(request, body, etag, {"Vary": "Accept-Encoding"})
+
+NDJSON_CHUNK_FEATURES = 1000
+
+def iter_stops_ndjson(all_stops, chunk=NDJSON_CHUNK_FEATURES):
+    """
+    Yields one GeoJSON Feature per line, chunk lines per write, so neither side
+    has to hold the whole collection and clients can render as lines arrive.
+    """
+    lines = []
+    for sid, stop in all_stops.items():
+        lines.append(dumps_json(stop_feature(sid, stop)))
+        if len(lines) == chunk:
+            lines.append(b"")
+            yield b"\n".join(lines)
+            lines = []
+    if lines:
+        lines.append(b"")
+        yield b"\n".join(lines)
+
+@app.get("/api/all-stops-ndjson")
+async def get_all_stops_ndjson():
+    # Streams from the stops loaded at request time; empty until the first load
+    return StreamingResponse(iter_stops_ndjson(stops_cache), media_type="application/x-ndjson")
 
 def format_time(seconds):
     """Formats seconds since midnight into HH:MM:SS, wrapping at 24 hours."""
@@ -388,30 +603,37 @@ def format_time(seconds):
 def slice_shape(shape_pts, from_lat, from_lon, to_lat, to_lon):
     if not shape_pts: return []
     
-    def dist_sq(p, lat, lon):
-        return (p[0] - lat)**2 + (p[1] - lon)**2
-
-    # Find the index in shape closest to the boarding stop
-    best_start_idx = 0
-    min_d_start = float('inf')
-    for i, pt in enumerate(shape_pts):
-        d = dist_sq(pt, from_lat, from_lon)
-        if d < min_d_start:
-            min_d_start = d
-            best_start_idx = i
+    # Distances are built by list comprehension and located with the C-level
+    # min/index, instead of a Python compare-and-assign per shape point
+
+    # Find the index in shape closest to the boarding stop (first minimum)
+    d_start = [(lat - from_lat)**2 + (lon - from_lon)**2 for lat, lon in shape_pts]
+    best_start_idx = d_start.index(min(d_start))
             
-    # Find the index in shape closest to the alighting stop (must be AFTER or AT start_idx)
-    best_end_idx = best_start_idx
-    min_d_end = float('inf')
-    for i in range(best_start_idx, len(shape_pts)):
-        d = dist_sq(shape_pts[i], to_lat, to_lon)
-        if d <= min_d_end:
-            min_d_end = d
-            best_end_idx = i
+    # Find the index in shape closest to the alighting stop (must be AFTER or AT start_idx);
+    # ties go to the LAST minimum, so search the reversed distances
+    d_end = [(lat - to_lat)**2 + (lon - to_lon)**2 for lat, lon in shape_pts[best_start_idx:]]
+    d_end.reverse()
+    best_end_idx = len(shape_pts) - 1 - d_end.index(min(d_end))
             
     # Return the segment
     return shape_pts[best_start_idx : best_end_idx + 1]
 
+# Sliced shapes per (shape_id, from_stop_id, to_stop_id); shapes and stop coordinates
+# never change after load, and the same legs recur across journeys and requests
+SHAPE_SLICE_CACHE_SIZE = 50000
+shape_slice_cache = {}
+
+def cached_slice_shape(shapes, shape_id, from_stop_id, from_stop, to_stop_id, to_stop):
+    key = (shape_id, from_stop_id, to_stop_id)
+    pts = shape_slice_cache.get(key)
+    if pts is None:
+        if len(shape_slice_cache) >= SHAPE_SLICE_CACHE_SIZE:
+            shape_slice_cache.clear()
+        pts = slice_shape(shapes[shape_id], from_stop.lat, from_stop.lon, to_stop.lat, to_stop.lon)
+        shape_slice_cache[key] = pts
+    return pts
+
 def format_transit_legs(legs, stops_cache, shapes_cache):
     """Convert raw RAPTOR leg dicts into frontend-ready step dicts."""
     steps = []
@@ -435,10 +657,10 @@ def format_transit_legs(legs, stops_cache, shapes_cache):
             step["RouteLongId"] = leg.get('route_id', '')
             shape_id = leg.get('shape_id')
             if shape_id and shape_id in shapes_cache:
-                step["Shape"] = slice_shape(
-                    shapes_cache[shape_id],
-                    from_stop.lat, from_stop.lon,
-                    to_stop.lat, to_stop.lon
+                step["Shape"] = cached_slice_shape(
+                    shapes_cache, shape_id,
+                    leg['from_stop_id'], from_stop,
+                    leg['to_stop_id'], to_stop
                 )
             else:
                 step["Shape"] = [[from_stop.lat, from_stop.lon], [to_stop.lat, to_stop.lon]]
@@ -449,16 +671,31 @@ def format_transit_legs(legs, stops_cache, shapes_cache):
     return steps
 
 @app.get("/api/route")
-async def get_route(source: str, target: str, earliest_dep: str = "21:00:00"):
+async def get_route(request: Request, source: str, target: str, earliest_dep: str = "21:00:00"):
     # Hardcoded search window: 9 PM to 11 PM California time
     dep_seconds = 21 * 3600  # 21:00:00 = 75600 seconds
     search_window = 2 * 3600  # 2-hour window = 7200 seconds
     
     if not router_instance:
-        return JSONResponse({"error": "Router not initialized"}, status_code=503)
+        return FastJSONResponse({"error": "Router not initialized"}, status_code=503)
+
+    # Nothing to route: skip the RAPTOR solves and carpool sub-queries entirely
+    if source == target:
+        return []
+
+    # The departure is fixed today, so repeat requests for an OD pair are served
+    # from the cached body without any RAPTOR query or formatting
+    cache_key = (source, target, dep_seconds)
+    cached = route_cache.get(cache_key)
+    if cached is not None:
+        route_cache.move_to_end(cache_key)
+        return bytes_response(request, *cached)
+    cache_version = route_cache_version
 
     # Search within the hardcoded 2-hour window (9 PM - 11 PM)
-    result = router_instance.query_range(source, target, dep_seconds, window=search_window)
+    # query_range blocks on the worker pool, so it runs off the event loop and
+    # concurrent /api/route requests are served in parallel
+    result = await asyncio.to_thread(router_instance.query_range, source, target, dep_seconds, window=search_window)
     
     formatted_journeys = []
     for journey in result['journeys']:
@@ -509,8 +746,9 @@ async def get_route(source: str, target: str, earliest_dep: str = "21:00:00"):
                 
                 # Shape Slicing
                 if leg['shape_id'] and leg['shape_id'] in shapes_cache:
-                    full_shape = shapes_cache[leg['shape_id']]
-                    step["Shape"] = slice_shape(full_shape, from_stop.lat, from_stop.lon, to_stop.lat, to_stop.lon)
+                    step["Shape"] = cached_slice_shape(shapes_cache, leg['shape_id'],
+                                                       leg['from_stop_id'], from_stop,
+                                                       leg['to_stop_id'], to_stop)
                 else:
                     # Basic shape if no shape_id
                     step["Shape"] = [[from_stop.lat, from_stop.lon], [to_stop.lat, to_stop.lon]]
@@ -566,6 +804,7 @@ async def get_route(source: str, target: str, earliest_dep: str = "21:00:00"):
     # Build: [carpool leg] + [transit legs]  or  [transit legs] + [carpool leg]
     # Uses parallel RAPTOR sub-queries for the transit parts.
     MAX_MIDPOINTS = 8  # Max intermediate stops to probe per carpool route
+    multimodal_count = 0
 
     if router_instance:
         for cp_rid, cp in carpool_routes_cache.items():
@@ -575,8 +814,8 @@ async def get_route(source: str, target: str, earliest_dep: str = "21:00:00"):
             cp_name  = cp['route_name']
 
             # ---- CASE A: carpool FIRST → transit to target ----
-            # Source must be on this carpool route
-            if source in cp_stops:
+            # Source must be on this carpool route, and transit must be able to reach the target
+            if source in cp_stops and router_instance.is_served(target, via_footpaths=True):
                 src_pos = cp_stops.index(source)
                 # All possible alighting stops AFTER source on carpool (skip if == target, handled above)
                 alighting = [(cp_stops[j], j) for j in range(src_pos + 1, len(cp_stops)) if cp_stops[j] != target]
@@ -589,11 +828,13 @@ async def get_route(source: str, target: str, earliest_dep: str = "21:00:00"):
                 futures_a = []
                 for sj, sj_idx in alighting:
                     transfer_dep = int(cp_arrs[sj_idx]) + 120  # 2-min buffer
-                    f = router_instance.executor.submit(run_raptor_worker, sj, target, transfer_dep)
+                    f = router_instance.submit_query(sj, target, transfer_dep)
                     futures_a.append((sj, sj_idx, f))
 
+                # The futures are shared through the submit_query LRU; shield keeps a
+                # cancelled request (client disconnect) from cancelling them for everyone
                 for sj, sj_idx, f in futures_a:
-                    sub = f.result()
+                    sub = await asyncio.shield(asyncio.wrap_future(f))
                     for sub_j in sub['journeys']:
                         if not sub_j['legs']:
                             continue
@@ -615,11 +856,13 @@ async def get_route(source: str, target: str, earliest_dep: str = "21:00:00"):
                         transit_steps = format_transit_legs(sub_j['legs'], stops_cache, shapes_cache)
                         if transit_steps:
                             formatted_journeys.append([carpool_step] + transit_steps)
-                            print(f"[CARPOOL] Multimodal A: {cp_name} -> transit, via {sj}")
+                            multimodal_count += 1
+                            if multimodal_count <= PRINT_HEAD:
+                                print(f"[CARPOOL] Multimodal A: {cp_name} -> transit, via {sj}")
 
             # ---- CASE B: transit FIRST → carpool to target ----
-            # Target must be on this carpool route
-            if target in cp_stops:
+            # Target must be on this carpool route, and transit must be able to leave the source
+            if target in cp_stops and router_instance.is_served(source):
                 tgt_pos = cp_stops.index(target)
                 # All possible boarding stops BEFORE target on carpool (skip if == source, handled above)
                 boarding = [(cp_stops[i], i) for i in range(tgt_pos) if cp_stops[i] != source]
@@ -630,11 +873,11 @@ async def get_route(source: str, target: str, earliest_dep: str = "21:00:00"):
                 # Submit parallel sub-RAPTOR: source → each boarding stop
                 futures_b = []
                 for si, si_idx in boarding:
-                    f = router_instance.executor.submit(run_raptor_worker, source, si, dep_seconds)
+                    f = router_instance.submit_query(source, si, dep_seconds)
                     futures_b.append((si, si_idx, f))
 
                 for si, si_idx, f in futures_b:
-                    sub = f.result()
+                    sub = await asyncio.shield(asyncio.wrap_future(f))
                     for sub_j in sub['journeys']:
                         if not sub_j['legs']:
                             continue
@@ -660,14 +903,24 @@ async def get_route(source: str, target: str, earliest_dep: str = "21:00:00"):
                         transit_steps = format_transit_legs(sub_j['legs'], stops_cache, shapes_cache)
                         if transit_steps:
                             formatted_journeys.append(transit_steps + [carpool_step])
-                            print(f"[CARPOOL] Multimodal B: transit -> {cp_name}, via {si}")
+                            multimodal_count += 1
+                            if multimodal_count <= PRINT_HEAD:
+                                print(f"[CARPOOL] Multimodal B: transit -> {cp_name}, via {si}")
+
+    if multimodal_count > PRINT_HEAD:
+        print(f"[CARPOOL] ... {multimodal_count - PRINT_HEAD} more multimodal journeys suppressed")
 
     # ====== END MULTI-MODAL CARPOOL INJECTION ======
 
     # ====== FINAL VALIDATION ======
     formatted_journeys = validate_journeys(formatted_journeys)
 
-    return formatted_journeys
+    body, etag = etagged(dumps_json(formatted_journeys))
+    if cache_version == route_cache_version:
+        route_cache[cache_key] = (body, etag)
+        if len(route_cache) > ROUTE_CACHE_SIZE:
+            route_cache.popitem(last=False)
+    return bytes_response(request, body, etag)
 
 
 @app.get("/health")
@@ -675,7 +928,13 @@ async def health():
     return {"status": "ok"}
 
 if __name__ == "__main__":
-    # Enabling 'reload=True' provides the 'watchdog' functionality 
-    # that restarts the server automatically when code changes.
+    # 'reload' provides the 'watchdog' functionality that restarts the server when
+    # code changes. It runs the app under a file-watching supervisor, so it is a
+    # development opt-in: RAPTOR_RELOAD=1.
+    # The server stays a single process on purpose: carpool routes are injected
+    # into this process's router, and route queries already fan out over the
+    # RaptorRouter process pool.
     # IMPORTANT: We must run 'socket_app' now
-    uvicorn.run("server:socket_app", host="127.0.0.1", port=5001, reload=True)
+    reload = os.environ.get('RAPTOR_RELOAD') == '1'
+    # Without reload the app object is passed directly, so this module is not imported a second time
+    uvicorn.run("server:socket_app" if reload else socket_app, host="127.0.0.1", port=5001, reload=reload)